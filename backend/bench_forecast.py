@@ -0,0 +1,100 @@
+"""Бенчмарк прогноза EOL для парка батарей.
+
+Сравнивает векторную подгонку forecast.fit_fleet/project_eol/project_curves для всего парка
+с циклом np.polyfit по батареям на синтетических кривых деградации.
+
+    python bench_forecast.py
+    python bench_forecast.py --batteries 100000 --min-cycles 20 --max-cycles 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+from forecast import MODELS, fit_fleet, project_curves, project_eol
+
+
+def synthetic_fleet(n_batteries, min_cycles, max_cycles, rng):
+    """Плоские массивы (index, cycles, capacity) для батарей разной длины истории"""
+    lengths = rng.integers(min_cycles, max_cycles + 1, n_batteries)
+    index = np.repeat(np.arange(n_batteries), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    cycles = (np.arange(len(index)) - starts + 1).astype(float)
+
+    kind = rng.integers(0, len(MODELS), n_batteries)[index]
+    initial = rng.uniform(1.8, 2.2, n_batteries)[index]
+    rate = rng.uniform(2e-4, 2e-3, n_batteries)[index]
+    capacity = np.select(
+        [kind == 0, kind == 1],
+        [initial * (1 - rate * cycles), initial * np.exp(-rate * cycles)],
+        initial * cycles ** (-rate * 20),
+    ) + rng.normal(0, 0.002, len(index))
+    return index, cycles, capacity
+
+
+def loop_forecast(index, cycles, capacity, n_batteries, eol_fraction, points):
+    """Та же задача по одной батарее за раз"""
+    starts = np.searchsorted(index, np.arange(n_batteries))
+    ends = np.searchsorted(index, np.arange(n_batteries), side='right')
+    for start, end in zip(starts, ends):
+        x, y = cycles[start:end], capacity[start:end]
+        threshold = eol_fraction * y[0]
+        best = None
+        for name, fx, fy in (('linear', x, y), ('exponential', x, np.log(y)), ('power', np.log(x), np.log(y))):
+            b, a = np.polyfit(fx, fy, 1)
+            predicted = a + b * fx if name == 'linear' else np.exp(a + b * fx)
+            sse = np.sum((y - predicted) ** 2)
+            if best is None or sse < best[0]:
+                best = (sse, name, a, b)
+        _, name, a, b = best
+        if name == 'linear':
+            eol = (threshold - a) / b
+        elif name == 'exponential':
+            eol = (np.log(threshold) - a) / b
+        else:
+            eol = np.exp((np.log(threshold) - a) / b)
+        curve_x = np.linspace(x[-1], max(eol, x[-1]), points)
+        if name == 'linear':
+            a + b * curve_x
+        elif name == 'exponential':
+            np.exp(a + b * curve_x)
+        else:
+            np.exp(a + b * np.log(curve_x))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batteries", type=int, default=100000)
+    parser.add_argument("--min-cycles", type=int, default=20)
+    parser.add_argument("--max-cycles", type=int, default=200)
+    parser.add_argument("--points", type=int, default=20)
+    parser.add_argument("--loop-sample", type=int, default=2000, help="батарей для замера цикла")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    index, cycles, capacity = synthetic_fleet(args.batteries, args.min_cycles, args.max_cycles, rng)
+    print(f"{args.batteries} batteries, {len(index)} measurements")
+
+    started = time.perf_counter()
+    fit = fit_fleet(index, cycles, capacity, args.batteries)
+    fitted = time.perf_counter()
+    projection = project_eol(fit)
+    curve_cycles, curve_capacity = project_curves(projection, np.arange(args.batteries), points=args.points)
+    finished = time.perf_counter()
+    print(f"vectorized: fit {(fitted - started) * 1000:.0f} ms, "
+          f"EOL + curves {(finished - fitted) * 1000:.0f} ms, total {(finished - started) * 1000:.0f} ms")
+    print(f"  models: " + ", ".join(
+        f"{name} {np.sum(fit['model'] == i)}" for i, name in enumerate(MODELS)
+    ) + f", curve array {curve_capacity.shape}")
+
+    sample = min(args.loop_sample, args.batteries)
+    mask = index < sample
+    started = time.perf_counter()
+    loop_forecast(index[mask], cycles[mask], capacity[mask], sample, 0.8, args.points)
+    elapsed = time.perf_counter() - started
+    print(f"per-battery loop: {elapsed * 1000:.0f} ms for {sample} batteries, "
+          f"~{elapsed * args.batteries / sample:.1f} s extrapolated to {args.batteries}")
+
+
+if __name__ == "__main__":
+    main()
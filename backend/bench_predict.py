@@ -0,0 +1,87 @@
+"""Бенчмарк интервального предсказания RUL.
+
+Сравнивает обычный model.predict, квантили через цикл по estimators_ и
+векторный обход StackedForest на синтетических данных.
+
+    python bench_predict.py
+    python bench_predict.py --batteries 2000 --batch 1000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ml_model import BatteryRULPredictor, StackedForest
+
+
+def synthetic_features(n, rng):
+    """Случайные векторы признаков в формате BatteryRULPredictor.battery_features"""
+    cycles = rng.integers(3, 1000, n)
+    slope = -rng.uniform(1e-4, 5e-3, n)
+    capacity = 2.0 + slope * cycles + rng.normal(0, 0.01, n)
+    return np.column_stack([
+        cycles,
+        slope,
+        capacity - slope * cycles / 2,
+        rng.uniform(0.01, 0.2, n),
+        -slope * cycles,
+        rng.uniform(3.0, 4.2, n),
+        rng.uniform(-2.0, 2.0, n),
+        rng.uniform(15.0, 45.0, n),
+        capacity,
+    ]), np.maximum(0, 1000 - cycles)
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batteries", type=int, default=2000, help="размер обучающей выборки")
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    from sklearn.ensemble import RandomForestRegressor
+
+    rng = np.random.default_rng(42)
+    X, y = synthetic_features(args.batteries, rng)
+
+    predictor = BatteryRULPredictor()
+    X_scaled = predictor.scaler.fit_transform(X)
+    predictor.model = RandomForestRegressor(n_estimators=100, random_state=42).fit(X_scaled, y)
+
+    started = time.perf_counter()
+    forest = StackedForest(predictor.model)
+    print(f"StackedForest build: {(time.perf_counter() - started) * 1000:.1f} ms, "
+          f"{len(forest.roots)} trees, max depth {forest.max_depth}")
+
+    X_query, _ = synthetic_features(args.batch, rng)
+    X_query = predictor.scaler.transform(X_query)
+    model = predictor.model
+
+    def loop_quantiles(X):
+        per_tree = np.column_stack([tree.predict(X) for tree in model.estimators_])
+        return np.percentile(per_tree, [10, 50, 90], axis=1)
+
+    def stacked_quantiles(X):
+        return np.percentile(forest.predict_trees(X), [10, 50, 90], axis=1)
+
+    assert np.allclose(forest.predict_trees(X_query).mean(axis=1), model.predict(X_query))
+    assert np.allclose(stacked_quantiles(X_query), loop_quantiles(X_query))
+
+    for label, X in (("single", X_query[:1]), (f"batch of {args.batch}", X_query)):
+        print(f"\n{label}:")
+        print(f"  model.predict               {best_of(lambda: model.predict(X), args.repeat):8.2f} ms")
+        print(f"  loop over estimators_       {best_of(lambda: loop_quantiles(X), args.repeat):8.2f} ms")
+        print(f"  StackedForest p10/p50/p90   {best_of(lambda: stacked_quantiles(X), args.repeat):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
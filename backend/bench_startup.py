@@ -0,0 +1,100 @@
+"""Бенчмарк времени запуска сервера.
+
+Выводит самые тяжёлые импорты (по данным `python -X importtime`) и время от
+запуска uvicorn до первого ответа 200 на /api/health.
+
+    python bench_startup.py
+    python bench_startup.py --preload --runs 5
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_report(module: str, top: int):
+    """Суммарное время импорта модуля и самые дорогие зависимости"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=HERE, capture_output=True, text=True, check=True,
+    )
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        head, cumulative_us, name = line.split("|")
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative_us), int(head.split(":")[1]), depth, name.strip()))
+
+    total = next(row[0] for row in rows if row[3] == module and row[2] == 0)
+    # Импорты первых двух уровней вложенности дают наиболее полезную картину
+    heaviest = sorted((row for row in rows if row[2] <= 1), reverse=True)
+    return total, heaviest[:top]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_200(module: str, preload: bool, timeout: float) -> float:
+    """Секунды от запуска процесса до первого успешного /api/health"""
+    port = _free_port()
+    env = dict(os.environ, PRELOAD_MODEL="1" if preload else "0")
+    url = f"http://127.0.0.1:{port}/api/health"
+
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn завершился с кодом {proc.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.01)
+        raise TimeoutError(f"Нет ответа от {url} за {timeout} с")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--preload", action="store_true", help="обучать модель при старте")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    total, rows = import_report(args.module, args.top)
+    print(f"import {args.module}: {total / 1000:.1f} ms")
+    print(f"{'cumulative, ms':>15} {'self, ms':>10}  module")
+    for cumulative, self_us, depth, name in rows:
+        print(f"{cumulative / 1000:>15.1f} {self_us / 1000:>10.1f}  {'  ' * depth}{name}")
+
+    timings = [time_to_first_200(args.module, args.preload, args.timeout) for _ in range(args.runs)]
+    print(f"\ntime to first 200 on /api/health (preload={args.preload}, runs={args.runs}): "
+          f"median {statistics.median(timings) * 1000:.0f} ms, "
+          f"min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
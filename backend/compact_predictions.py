@@ -0,0 +1,18 @@
+"""Очистка журнала предсказаний (запускать по расписанию, например cron раз в сутки)"""
+from config import settings
+from database import SessionLocal, init_db
+from prediction_log import compact
+
+init_db()
+
+db = SessionLocal()
+
+try:
+    expired, downsampled = compact(db)
+    print(f"🗑️  Удалено записей старше {settings.PREDICTION_RETENTION_DAYS} дн.: {expired}")
+    print(f"🧹 Прорежено записей старше {settings.PREDICTION_DOWNSAMPLE_AFTER_DAYS} дн.: {downsampled}")
+except Exception as e:
+    print(f"❌ Ошибка при очистке журнала: {e}")
+    db.rollback()
+finally:
+    db.close()
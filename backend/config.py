@@ -1,3 +1,4 @@
+import os
 from datetime import timedelta
 
 class Settings:
@@ -13,4 +14,23 @@ class Settings:
     ALGORITHM = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 часа
 
+    # Обучать модель при старте сервера, а не при первом предсказании
+    PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "").lower() in ("1", "true", "yes")
+
+    # Журнал предсказаний: пакетная запись и хранение
+    PREDICTION_LOG_FLUSH_ROWS = 500
+    PREDICTION_LOG_FLUSH_SECONDS = 5.0
+    PREDICTION_RETENTION_DAYS = 90
+    PREDICTION_DOWNSAMPLE_AFTER_DAYS = 7  # старше - одна запись в сутки на батарею
+
+    # Профилирование запросов по требованию администратора
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "1").lower() in ("1", "true", "yes")
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_MAX_CAPTURES = 50
+    PROFILE_INTERVAL_MS = 5.0
+
+    # Кеш подгонки прогноза EOL по парку (на владельца и модель)
+    FORECAST_CACHE_SECONDS = 60
+    FORECAST_CACHE_SIZE = 32
+
 settings = Settings()
@@ -0,0 +1,237 @@
+"""Сводка по парку батарей пользователя.
+
+Считается одним SQL-запросом: GROUP BY по battery_id даёт число циклов, а
+первое и последнее измерение каждой батареи находятся коррелированными
+подзапросами по индексу (owner_id, battery_id, timestamp) и подтягиваются
+по первичному ключу. Текущий RUL берётся из latest_predictions, общее число
+батарей - через count() over ().
+
+fleet_forecast читает циклы и ёмкости парка курсором прямо в массивы numpy
+и передаёт их в forecast; результат подгонки кешируется на владельца и
+модель (FORECAST_CACHE_SECONDS), поэтому листание страниц прогноза не
+перечитывает все измерения.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, aliased
+
+from config import settings
+from models import BatteryData, LatestPrediction
+
+SORT_FIELDS = ('rul', 'battery_id', 'cycles', 'capacity_fade', 'last_seen')
+
+# (owner_id, model) -> (время подгонки, battery_ids, fit)
+_fit_cache = OrderedDict()
+_fit_lock = threading.Lock()
+
+
+def fleet_summary(db: Session, owner_id: int, sort: str = 'rul', order: str = 'asc',
+                  limit: int = 50, offset: int = 0):
+    """Страница сводки по батареям владельца; возвращает (total, items)"""
+    grouped = aliased(BatteryData)
+    edge = aliased(BatteryData)
+
+    def edge_id(latest: bool):
+        ordering = (edge.timestamp.desc(), edge.id.desc()) if latest else (edge.timestamp, edge.id)
+        return select(edge.id).where(
+            edge.owner_id == owner_id, edge.battery_id == grouped.battery_id
+        ).order_by(*ordering).limit(1).scalar_subquery()
+
+    per_battery = select(
+        grouped.battery_id,
+        func.count().label('cycles'),
+        edge_id(latest=True).label('last_id'),
+        edge_id(latest=False).label('first_id'),
+    ).where(grouped.owner_id == owner_id).group_by(grouped.battery_id).subquery()
+
+    last = aliased(BatteryData)
+    first = aliased(BatteryData)
+    capacity_fade = (first.capacity - last.capacity).label('capacity_fade')
+    sort_columns = {
+        'rul': LatestPrediction.predicted_rul,
+        'battery_id': per_battery.c.battery_id,
+        'cycles': per_battery.c.cycles,
+        'capacity_fade': capacity_fade,
+        'last_seen': last.timestamp,
+    }
+    sort_column = sort_columns[sort]
+    direction = sort_column.desc() if order == 'desc' else sort_column.asc()
+
+    query = select(
+        per_battery.c.battery_id,
+        per_battery.c.cycles,
+        capacity_fade,
+        last.timestamp,
+        last.voltage,
+        last.current,
+        last.temperature,
+        last.capacity,
+        last.cycle_number,
+        LatestPrediction.predicted_rul,
+        LatestPrediction.rul_p10,
+        LatestPrediction.rul_p90,
+        LatestPrediction.confidence,
+        LatestPrediction.timestamp.label('predicted_at'),
+        func.count().over().label('total'),
+    ).join(
+        last, last.id == per_battery.c.last_id
+    ).join(
+        first, first.id == per_battery.c.first_id
+    ).outerjoin(
+        LatestPrediction,
+        (LatestPrediction.owner_id == owner_id) & (LatestPrediction.battery_id == per_battery.c.battery_id),
+    ).order_by(
+        # Батареи без данных для сортировки - в конце при любом направлении
+        sort_column.is_(None), direction, per_battery.c.battery_id
+    ).limit(limit).offset(offset)
+
+    rows = db.execute(query).all()
+    total = rows[0].total if rows else _count_batteries(db, owner_id)
+    return total, [_summary_item(row) for row in rows]
+
+
+def _count_batteries(db: Session, owner_id: int) -> int:
+    # Нужен только когда offset вышел за пределы парка
+    return db.execute(
+        select(func.count(func.distinct(BatteryData.battery_id))).where(BatteryData.owner_id == owner_id)
+    ).scalar()
+
+
+def _round(value, digits=2):
+    return None if value is None else round(value, digits)
+
+
+def _summary_item(row) -> dict:
+    return {
+        "battery_id": row.battery_id,
+        "cycles": row.cycles,
+        "capacity_fade": _round(row.capacity_fade, 4),
+        "latest_measurement": {
+            "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+            "voltage": row.voltage,
+            "current": row.current,
+            "temperature": row.temperature,
+            "capacity": row.capacity,
+            "cycle_number": row.cycle_number
+        },
+        "rul": _round(row.predicted_rul),
+        "rul_p10": _round(row.rul_p10),
+        "rul_p90": _round(row.rul_p90),
+        "confidence": _round(row.confidence),
+        "predicted_at": row.predicted_at.isoformat() if row.predicted_at else None
+    }
+
+
+def _raw_chunks(db: Session, query, size: int = 65536):
+    """Строки запроса кортежами DBAPI пачками по size, без объектов Row"""
+    connection = db.connection()
+    compiled = query.compile(dialect=connection.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(str(compiled), params)
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def _load_measurements(db: Session, owner_id: int):
+    """Измерения парка плоскими массивами: (battery_ids, index, cycles, capacity).
+
+    battery_id не читается для каждой строки: сначала GROUP BY по индексу даёт
+    число измерений каждой батареи, затем циклы и ёмкости в том же порядке
+    читаются курсором в заранее выделенные массивы, а номер батареи
+    восстанавливается через np.repeat. Граница по id делает оба запроса
+    согласованными при параллельной вставке.
+    """
+    import numpy as np
+
+    max_id = db.execute(select(func.max(BatteryData.id))).scalar()
+    if max_id is None:
+        return [], None, None, None
+    conditions = (
+        BatteryData.owner_id == owner_id,
+        BatteryData.id <= max_id,
+        BatteryData.cycle_number.is_not(None),
+        BatteryData.capacity.is_not(None),
+    )
+
+    groups = db.execute(
+        select(BatteryData.battery_id, func.count()).where(*conditions)
+        .group_by(BatteryData.battery_id).order_by(BatteryData.battery_id)
+    ).all()
+    battery_ids = [battery_id for battery_id, _ in groups]
+    counts = np.fromiter((count for _, count in groups), dtype=np.intp, count=len(groups))
+
+    values = np.empty((int(counts.sum()), 2))
+    position = 0
+    query = select(BatteryData.cycle_number, BatteryData.capacity).where(*conditions).order_by(BatteryData.battery_id)
+    for rows in _raw_chunks(db, query):
+        values[position:position + len(rows)] = rows
+        position += len(rows)
+
+    index = np.repeat(np.arange(len(battery_ids)), counts)
+    return battery_ids, index, values[:, 0], values[:, 1]
+
+
+def _fleet_fit(db: Session, owner_id: int, model: str):
+    """Подгонка для парка владельца с кешированием на FORECAST_CACHE_SECONDS"""
+    from forecast import fit_fleet
+
+    key = (owner_id, model)
+    now = time.monotonic()
+    with _fit_lock:
+        cached = _fit_cache.get(key)
+        if cached is not None and now - cached[0] < settings.FORECAST_CACHE_SECONDS:
+            _fit_cache.move_to_end(key)
+            return cached[1], cached[2]
+
+    battery_ids, index, cycles, capacity = _load_measurements(db, owner_id)
+    fit = fit_fleet(index, cycles, capacity, len(battery_ids), model=model) if battery_ids else None
+
+    with _fit_lock:
+        _fit_cache[key] = (now, battery_ids, fit)
+        _fit_cache.move_to_end(key)
+        while len(_fit_cache) > settings.FORECAST_CACHE_SIZE:
+            _fit_cache.popitem(last=False)
+    return battery_ids, fit
+
+
+def invalidate_forecast(owner_id: int):
+    """Сброс кешированной подгонки владельца после поступления новых данных"""
+    with _fit_lock:
+        for key in [key for key in _fit_cache if key[0] == owner_id]:
+            del _fit_cache[key]
+
+
+def fleet_forecast(db: Session, owner_id: int, model: str = 'auto', eol_fraction: float = 0.8,
+                   points: int = 20, max_cycles: float = 10000, limit: int = 50, offset: int = 0):
+    """Прогноз EOL для всех батарей владельца, страница по возрастанию остатка циклов"""
+    # numpy и forecast нужны только здесь - не грузим их при старте сервера
+    import numpy as np
+    from forecast import forecast_items, project_curves, project_eol
+
+    battery_ids, fit = _fleet_fit(db, owner_id, model)
+    if not battery_ids:
+        return 0, []
+
+    # EOL для всего парка нужен для сортировки; точки кривой - только для страницы
+    projection = project_eol(fit, eol_fraction=eol_fraction)
+
+    # Сначала батареи с наименьшим остатком; без прогноза - в конце
+    remaining = projection['remaining_cycles']
+    order = np.lexsort((np.arange(len(battery_ids)), np.where(np.isnan(remaining), np.inf, remaining),
+                        np.isnan(remaining)))
+    page = order[offset:offset + limit]
+    curves = project_curves(projection, page, points=points, max_cycles=max_cycles)
+    return len(battery_ids), forecast_items(battery_ids, projection, page, curves)
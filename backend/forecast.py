@@ -0,0 +1,230 @@
+"""Прогноз кривой ёмкости и конца срока службы (EOL) для всего парка.
+
+Модели деградации сводятся к линейной регрессии y = a + b*x после замены
+переменных:
+
+- linear:      C = a + b*n                 (x = n,     y = C)
+- exponential: C = a * exp(b*n)            (x = n,     y = ln C)
+- power:       C = a * n**b                (x = ln n,  y = ln C)
+
+Данные всех батарей передаются плоскими массивами с индексом батареи
+(ragged), суммы для нормальных уравнений считаются через np.bincount, поэтому
+все батареи подгоняются одновременно, без цикла по батареям.
+"""
+import numpy as np
+
+MODELS = ('linear', 'exponential', 'power')
+MIN_POINTS = 3
+
+
+def _fit_transformed(index, x, y, valid, n_batteries):
+    """МНК y = a + b*x для каждой батареи; возвращает (a, b), NaN где не хватает точек"""
+    if valid.all():
+        n = np.bincount(index, minlength=n_batteries).astype(float)
+    else:
+        index, x, y = index[valid], x[valid], y[valid]
+        n = np.bincount(index, minlength=n_batteries).astype(float)
+
+    sx = np.bincount(index, x, n_batteries)
+    sy = np.bincount(index, y, n_batteries)
+    sxx = np.bincount(index, x * x, n_batteries)
+    sxy = np.bincount(index, x * y, n_batteries)
+
+    det = n * sxx - sx * sx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b = (n * sxy - sx * sy) / det
+        a = (sy - b * sx) / n
+    bad = (n < MIN_POINTS) | (np.abs(det) < 1e-12)
+    a[bad] = np.nan
+    b[bad] = np.nan
+    return a, b
+
+
+def _edge_positions(index, cycles, reduce, starts, has_data, battery_numbers):
+    """Позиция измерения с минимальным/максимальным циклом в каждой группе index"""
+    edge_cycle = np.zeros(len(starts))
+    edge_cycle[has_data] = reduce.reduceat(cycles, starts[has_data])
+    candidates = np.flatnonzero(cycles == edge_cycle[index])
+    positions = candidates[np.searchsorted(index[candidates], battery_numbers).clip(max=len(candidates) - 1)]
+    return np.where(has_data, positions, 0)
+
+
+def capacity_curve(model: str, a, b, cycles):
+    """Ёмкость по модели; a и b транслируются на форму cycles"""
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        if model == 'linear':
+            return a + b * cycles
+        if model == 'exponential':
+            return np.exp(a) * np.exp(b * cycles)
+        return np.exp(a) * np.power(cycles, b)
+
+
+def _eol_cycle(model: str, a, b, threshold):
+    """Цикл, на котором модель опускается до threshold; inf, если ёмкость не падает"""
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if model == 'linear':
+            eol = (threshold - a) / b
+        elif model == 'exponential':
+            eol = (np.log(threshold) - a) / b
+        else:
+            eol = np.exp((np.log(threshold) - a) / b)
+    return np.where(b < 0, eol, np.inf)
+
+
+def fit_fleet(index, cycles, capacity, n_batteries: int, model: str = 'auto'):
+    """Подгонка моделей деградации ко всем батареям сразу.
+
+    index    - номер батареи (0..n_batteries-1) для каждого измерения
+    cycles   - номер цикла измерения
+    capacity - измеренная ёмкость
+
+    Быстрее всего, если измерения сгруппированы по index (упорядочены по нему).
+
+    model='auto' выбирает для каждой батареи модель с наименьшей суммой
+    квадратов ошибок в исходных единицах ёмкости. Возвращает словарь массивов
+    длины n_batteries: model (индекс в MODELS, -1 если подгонка невозможна),
+    a, b, rmse, first_cycle, last_cycle, initial_capacity, last_capacity.
+    """
+    index = np.asarray(index, dtype=np.intp)
+    cycles = np.asarray(cycles, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+
+    if np.any(index[1:] < index[:-1]):
+        order = np.argsort(index, kind='stable')
+        index, cycles, capacity = index[order], cycles[order], capacity[order]
+
+    candidates = MODELS if model == 'auto' else (model,)
+    positive = capacity > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_capacity = np.log(capacity)
+        log_cycles = np.log(cycles)
+    transforms = {
+        'linear': (cycles, capacity, np.isfinite(capacity)),
+        'exponential': (cycles, log_capacity, positive),
+        'power': (log_cycles, log_capacity, positive & (cycles > 0)),
+    }
+
+    counts = np.bincount(index, minlength=n_batteries)
+    best_sse = np.full(n_batteries, np.inf)
+    best_model = np.full(n_batteries, -1)
+    best_a = np.full(n_batteries, np.nan)
+    best_b = np.full(n_batteries, np.nan)
+
+    for name in candidates:
+        x, y, valid = transforms[name]
+        a, b = _fit_transformed(index, x, y, valid, n_batteries)
+        # Ошибку считаем по всем точкам батареи в единицах ёмкости, чтобы модели были сравнимы
+        with np.errstate(over='ignore', invalid='ignore'):
+            fitted = a[index] + b[index] * x
+            if name != 'linear':
+                fitted = np.exp(fitted)
+            residual = capacity - fitted
+            sse = np.bincount(index, residual * residual, n_batteries)
+        # NaN в sse (модель неприменима к части точек) не проходит сравнение
+        better = np.isfinite(a) & np.isfinite(b) & (sse < best_sse)
+        best_sse[better] = sse[better]
+        best_model[better] = MODELS.index(name)
+        best_a[better] = a[better]
+        best_b[better] = b[better]
+
+    # Первое и последнее измерение каждой батареи - с минимальным и
+    # максимальным номером цикла; ищем их без полной сортировки
+    battery_numbers = np.arange(n_batteries)
+    has_data = counts > 0
+    starts = np.searchsorted(index, battery_numbers)
+    first = _edge_positions(index, cycles, np.minimum, starts, has_data, battery_numbers)
+    last = _edge_positions(index, cycles, np.maximum, starts, has_data, battery_numbers)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rmse = np.sqrt(best_sse / counts)
+    return {
+        'model': best_model,
+        'a': best_a,
+        'b': best_b,
+        'rmse': np.where(best_model >= 0, rmse, np.nan),
+        'first_cycle': np.where(has_data, cycles[first], np.nan),
+        'last_cycle': np.where(has_data, cycles[last], np.nan),
+        'initial_capacity': np.where(has_data, capacity[first], np.nan),
+        'last_capacity': np.where(has_data, capacity[last], np.nan),
+    }
+
+
+def project_eol(fit: dict, eol_fraction: float = 0.8):
+    """Цикл EOL (ёмкость = eol_fraction от начальной) для всех батарей.
+
+    Возвращает fit, дополненный eol_cycle, remaining_cycles и eol_capacity.
+    Точки кривой считает project_curves - только для нужных строк.
+    """
+    model = fit['model']
+    threshold = eol_fraction * fit['initial_capacity']
+
+    eol = np.full(len(model), np.nan)
+    for i, name in enumerate(MODELS):
+        mask = model == i
+        if mask.any():
+            eol[mask] = _eol_cycle(name, fit['a'][mask], fit['b'][mask], threshold[mask])
+
+    return {
+        **fit,
+        'eol_capacity': threshold,
+        'eol_cycle': eol,
+        # Уже достигшие порога батареи имеют нулевой остаток
+        'remaining_cycles': np.maximum(eol - fit['last_cycle'], 0),
+    }
+
+
+def project_curves(projection: dict, rows, points: int = 20, max_cycles: float = 10000):
+    """Точки прогнозной кривой для батарей rows (массивы len(rows) x points).
+
+    Кривая строится от последнего измерения до EOL, но не дальше max_cycles
+    циклов вперёд. Возвращает (curve_cycles, curve_capacity).
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    model = projection['model'][rows]
+    horizon = np.minimum(projection['remaining_cycles'][rows], max_cycles)
+    horizon = np.where(np.isfinite(horizon), horizon, max_cycles)
+
+    steps = np.linspace(0.0, 1.0, points)
+    curve_cycles = projection['last_cycle'][rows, None] + horizon[:, None] * steps[None, :]
+    curve_capacity = np.full(curve_cycles.shape, np.nan)
+    for i, name in enumerate(MODELS):
+        mask = model == i
+        if mask.any():
+            curve_capacity[mask] = capacity_curve(
+                name, projection['a'][rows[mask], None], projection['b'][rows[mask], None], curve_cycles[mask]
+            )
+    return curve_cycles, curve_capacity
+
+
+def _number(value, digits=4):
+    value = float(value)
+    return round(value, digits) if np.isfinite(value) else None
+
+
+def forecast_items(battery_ids, projection: dict, rows, curves) -> list:
+    """JSON-представление прогноза для выбранных батарей.
+
+    rows - индексы батарей, curves - результат project_curves для тех же rows.
+    """
+    items = []
+    for row, curve_cycles, curve_capacity in zip(rows, *curves):
+        model = int(projection['model'][row])
+        a = projection['a'][row]
+        items.append({
+            "battery_id": battery_ids[row],
+            "model": MODELS[model] if model >= 0 else None,
+            # Для exponential и power подгонялся ln a
+            "params": {"a": _number(a if model <= 0 else np.exp(a), 6), "b": _number(projection['b'][row], 8)},
+            "rmse": _number(projection['rmse'][row]),
+            "last_cycle": _number(projection['last_cycle'][row], 0),
+            "initial_capacity": _number(projection['initial_capacity'][row]),
+            "last_capacity": _number(projection['last_capacity'][row]),
+            "eol_capacity": _number(projection['eol_capacity'][row]),
+            "eol_cycle": _number(projection['eol_cycle'][row], 1),
+            "remaining_cycles": _number(projection['remaining_cycles'][row], 1),
+            "curve": [
+                {"cycle": _number(cycle, 1), "capacity": _number(capacity)}
+                for cycle, capacity in zip(curve_cycles, curve_capacity)
+            ] if model >= 0 else []
+        })
+    return items
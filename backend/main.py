@@ -1,37 +1,24 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from sqlalchemy.orm import Session
 from datetime import datetime
-import json
 
-from database import get_db, init_db
-from models import BatteryData, PredictionResult, User
-from schemas import UserRegister, UserLogin, Token, BatteryIn
-from auth import hash_password, verify_password, create_access_token, get_current_user
-from ml_model import BatteryRULPredictor
+import predictor
+from config import settings
+from database import SessionLocal, get_db, init_db
+from fleet import SORT_FIELDS, fleet_forecast, fleet_summary, invalidate_forecast
+from models import BatteryData, LatestPrediction, User
+from prediction_log import prediction_log, record_predictions
+from schemas import UserRegister, UserLogin, Token, BatteryIn, BatchPredictIn, ProfilingRuleIn
+from auth import hash_password, verify_password, create_access_token, get_current_user, get_current_admin
+from profiling import ProfilingMiddleware, profiler, to_collapsed, to_speedscope
 
-app = FastAPI(title="Unified Battery System")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-init_db()
-predictor = BatteryRULPredictor()
-
-
-@app.on_event("startup")
-async def startup():
-    db = next(get_db())
-    predictor.train(db)
+router = APIRouter()
 
 
 # -------- AUTH --------
-@app.post("/api/auth/register")
+@router.post("/api/auth/register")
 def register(user: UserRegister, db: Session = Depends(get_db)):
     if db.query(User).filter((User.email == user.email) | (User.username == user.username)).first():
         raise HTTPException(status_code=400, detail="User exists")
@@ -47,7 +34,7 @@ def register(user: UserRegister, db: Session = Depends(get_db)):
     return {"message": "registered", "user_id": db_user.id}
 
 
-@app.post("/api/auth/login", response_model=Token)
+@router.post("/api/auth/login", response_model=Token)
 def login(user: UserLogin, db: Session = Depends(get_db)):
     db_user = db.query(User).filter(User.username == user.username).first()
     if not db_user or not verify_password(user.password, db_user.password_hash):
@@ -62,7 +49,7 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
 
 
 # -------- BATTERY --------
-@app.post("/api/battery-data")
+@router.post("/api/battery-data")
 def add_battery(data: BatteryIn, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     """Добавление новых данных от батареи"""
     try:
@@ -79,8 +66,9 @@ def add_battery(data: BatteryIn, db: Session = Depends(get_db), user: User = Dep
         db.commit()
         db.refresh(record)
 
-        # Переобучаем модель
-        predictor.train(db)
+        # Переобучаем модель (если она уже загружена) и сбрасываем прогноз парка
+        predictor.refresh(db)
+        invalidate_forecast(user.id)
 
         return {"status": "ok", "id": record.id, "message": "Data added successfully"}
     except Exception as e:
@@ -88,7 +76,7 @@ def add_battery(data: BatteryIn, db: Session = Depends(get_db), user: User = Dep
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.get("/api/battery-history/{battery_id}")
+@router.get("/api/battery-history/{battery_id}")
 def get_battery_history(
         battery_id: str,
         db: Session = Depends(get_db),
@@ -116,7 +104,7 @@ def get_battery_history(
     }
 
 
-@app.get("/api/predict-rul/{battery_id}")
+@router.get("/api/predict-rul/{battery_id}")
 def predict_rul(
         battery_id: str,
         db: Session = Depends(get_db),
@@ -134,41 +122,18 @@ def predict_rul(
             raise HTTPException(status_code=404, detail="No battery data found")
 
         # Подготовка данных для предсказания
-        history = [
-            {
-                'voltage': r.voltage,
-                'current': r.current,
-                'temperature': r.temperature,
-                'capacity': r.capacity,
-                'cycle_number': r.cycle_number
-            } for r in battery_data
-        ]
+        history = [_measurement(r) for r in battery_data]
 
         # Предсказание
-        predicted_rul, confidence = predictor.predict(history)
+        interval = predictor.get_predictor(db).predict_interval(history)
 
-        if predicted_rul is None:
+        if interval is None:
             raise HTTPException(status_code=400, detail="Prediction failed")
 
         # Сохранение результата предсказания
-        pred_record = PredictionResult(
-            battery_id=battery_id,
-            predicted_rul=predicted_rul,
-            confidence=confidence,
-            features=json.dumps(history[-1]),
-            owner_id=user.id
-        )
-        db.add(pred_record)
-        db.commit()
+        record_predictions(db, [_prediction_row(battery_id, interval, history[-1], user.id)])
 
-        return {
-            "battery_id": battery_id,
-            "predicted_rul": round(predicted_rul, 2),
-            "rul": round(predicted_rul, 2),  # Добавляем для совместимости с frontend
-            "confidence": round(confidence, 2),
-            "current_cycle": battery_data[-1].cycle_number,
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        return _prediction_response(battery_id, interval, battery_data[-1].cycle_number)
 
     except HTTPException:
         raise
@@ -176,26 +141,282 @@ def predict_rul(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/retrain-model")
+@router.post("/api/predict-rul")
+def predict_rul_batch(
+        request: BatchPredictIn,
+        db: Session = Depends(get_db),
+        user: User = Depends(get_current_user)
+):
+    """Предсказание RUL с интервалами для нескольких батарей за один проход модели"""
+    # Повторяющиеся id считаем один раз, порядок сохраняем
+    battery_ids = list(dict.fromkeys(request.battery_ids))
+    try:
+        battery_data = db.query(BatteryData).filter(
+            BatteryData.battery_id.in_(battery_ids),
+            BatteryData.owner_id == user.id
+        ).order_by(BatteryData.battery_id, BatteryData.timestamp).all()
+
+        histories = {}
+        last_cycles = {}
+        for r in battery_data:
+            histories.setdefault(r.battery_id, []).append(_measurement(r))
+            last_cycles[r.battery_id] = r.cycle_number
+
+        intervals = predictor.get_predictor(db).predict_batch(histories) if histories else {}
+
+        results = []
+        rows = []
+        for battery_id in battery_ids:
+            interval = intervals.get(battery_id)
+            if interval is None:
+                results.append({"battery_id": battery_id, "error": "Prediction failed"})
+                continue
+            rows.append(_prediction_row(battery_id, interval, histories[battery_id][-1], user.id))
+            results.append(_prediction_response(battery_id, interval, last_cycles[battery_id]))
+        record_predictions(db, rows)
+
+        return {"predictions": results}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _measurement(record: BatteryData) -> dict:
+    return {
+        'voltage': record.voltage,
+        'current': record.current,
+        'temperature': record.temperature,
+        'capacity': record.capacity,
+        'cycle_number': record.cycle_number
+    }
+
+
+def _prediction_row(battery_id: str, interval: dict, last_measurement: dict, owner_id: int) -> dict:
+    return {
+        'owner_id': owner_id,
+        'battery_id': battery_id,
+        'predicted_rul': interval['rul'],
+        'rul_p10': interval['p10'],
+        'rul_p50': interval['p50'],
+        'rul_p90': interval['p90'],
+        'confidence': interval['confidence'],
+        'current_cycle': last_measurement['cycle_number'],
+        'measurement': last_measurement,  # Последние измерения
+    }
+
+
+def _prediction_response(battery_id: str, interval: dict, current_cycle: int) -> dict:
+    return {
+        "battery_id": battery_id,
+        "predicted_rul": round(interval['rul'], 2),
+        "rul": round(interval['rul'], 2),  # Добавляем для совместимости с frontend
+        "rul_p10": round(interval['p10'], 2),
+        "rul_p50": round(interval['p50'], 2),
+        "rul_p90": round(interval['p90'], 2),
+        "confidence": round(interval['confidence'], 2),
+        "current_cycle": current_cycle,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.get("/api/predictions/latest")
+def get_latest_predictions(
+        battery_id: str | None = None,
+        db: Session = Depends(get_db),
+        user: User = Depends(get_current_user)
+):
+    """Текущий RUL батарей пользователя из latest_predictions"""
+    query = db.query(LatestPrediction).filter(LatestPrediction.owner_id == user.id)
+    if battery_id is not None:
+        query = query.filter(LatestPrediction.battery_id == battery_id)
+
+    return {
+        "predictions": [
+            {
+                "battery_id": p.battery_id,
+                "predicted_rul": round(p.predicted_rul, 2),
+                "rul_p10": round(p.rul_p10, 2),
+                "rul_p50": round(p.rul_p50, 2),
+                "rul_p90": round(p.rul_p90, 2),
+                "confidence": round(p.confidence, 2),
+                "current_cycle": p.current_cycle,
+                "timestamp": p.timestamp.isoformat()
+            }
+            for p in query.order_by(LatestPrediction.battery_id).all()
+        ]
+    }
+
+
+@router.get("/api/fleet/summary")
+def get_fleet_summary(
+        sort: str = Query("rul", pattern=f"^({'|'.join(SORT_FIELDS)})$"),
+        order: str = Query("asc", pattern="^(asc|desc)$"),
+        limit: int = Query(50, ge=1, le=1000),
+        offset: int = Query(0, ge=0),
+        db: Session = Depends(get_db),
+        user: User = Depends(get_current_user)
+):
+    """Сводка по всем батареям пользователя (по умолчанию - сначала наименьший RUL)"""
+    total, items = fleet_summary(db, user.id, sort=sort, order=order, limit=limit, offset=offset)
+    return {
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "sort": sort,
+        "order": order,
+        "batteries": items
+    }
+
+
+@router.get("/api/fleet/forecast")
+def get_fleet_forecast(
+        model: str = Query("auto", pattern="^(auto|linear|exponential|power)$"),
+        eol_fraction: float = Query(0.8, gt=0, lt=1),
+        points: int = Query(20, ge=2, le=200),
+        max_cycles: float = Query(10000, gt=0),
+        limit: int = Query(50, ge=1, le=1000),
+        offset: int = Query(0, ge=0),
+        db: Session = Depends(get_db),
+        user: User = Depends(get_current_user)
+):
+    """Прогноз кривой ёмкости и цикла EOL для всех батарей пользователя"""
+    total, items = fleet_forecast(
+        db, user.id, model=model, eol_fraction=eol_fraction, points=points,
+        max_cycles=max_cycles, limit=limit, offset=offset
+    )
+    return {
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "model": model,
+        "eol_fraction": eol_fraction,
+        "batteries": items
+    }
+
+
+@router.post("/api/retrain-model")
 def retrain_model(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     """Переобучение модели"""
     try:
-        success = predictor.train(db)
+        success = predictor.retrain(db)
         return {"success": success, "message": "Model retrained successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Retraining failed: {str(e)}")
 
 
-@app.get("/api/health")
+# -------- PROFILING (ADMIN) --------
+@router.get("/api/admin/profiling")
+def get_profiling_status(admin: User = Depends(get_current_admin)):
+    """Активные правила профилирования и сохранённые снимки"""
+    return {
+        "enabled": settings.PROFILING_ENABLED,
+        "rules": profiler.list_rules(),
+        "captures": profiler.list_captures()
+    }
+
+
+@router.post("/api/admin/profiling/rules")
+def add_profiling_rule(rule: ProfilingRuleIn, admin: User = Depends(get_current_admin)):
+    """Включение профилирования для эндпоинта (шаблон пути) на время или N запросов;
+    с header_only - только запросов администратора с заголовком X-Profile"""
+    if not settings.PROFILING_ENABLED:
+        raise HTTPException(status_code=409, detail="Profiling is disabled (PROFILING_ENABLED=0)")
+    return profiler.add_rule(
+        pattern=rule.pattern,
+        duration_seconds=rule.duration_seconds,
+        max_requests=rule.max_requests,
+        interval_ms=rule.interval_ms,
+        header_only=rule.header_only
+    )
+
+
+@router.delete("/api/admin/profiling/rules/{rule_id}")
+def delete_profiling_rule(rule_id: str, admin: User = Depends(get_current_admin)):
+    if not profiler.remove_rule(rule_id):
+        raise HTTPException(status_code=404, detail="Rule not found")
+    return {"status": "ok"}
+
+
+@router.delete("/api/admin/profiling/rules")
+def clear_profiling_rules(admin: User = Depends(get_current_admin)):
+    profiler.clear_rules()
+    return {"status": "ok"}
+
+
+@router.get("/api/admin/profiling/captures/{capture_id}")
+def download_profile(
+        capture_id: str,
+        format: str = Query("speedscope", pattern="^(speedscope|collapsed|raw)$"),
+        admin: User = Depends(get_current_admin)
+):
+    """Снимок профиля: speedscope JSON, collapsed stacks для flamegraph.pl или исходный JSON"""
+    capture = profiler.load(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Capture not found")
+
+    filename = f"profile-{capture_id}"
+    if format == "collapsed":
+        return PlainTextResponse(
+            to_collapsed(capture),
+            headers={"Content-Disposition": f'attachment; filename="{filename}.collapsed.txt"'}
+        )
+    if format == "speedscope":
+        capture = to_speedscope(capture)
+        filename += ".speedscope"
+    return JSONResponse(capture, headers={"Content-Disposition": f'attachment; filename="{filename}.json"'})
+
+
+@router.get("/api/health")
 def health_check():
     """Проверка состояния системы"""
     return {
         "status": "healthy",
-        "model_trained": predictor.is_trained,
+        "model_trained": predictor.is_trained(),
         "timestamp": datetime.utcnow().isoformat()
     }
 
 
+def create_app(preload_model: bool = settings.PRELOAD_MODEL) -> FastAPI:
+    """Создание приложения.
+
+    БД инициализируется при старте сервера, а не при импорте модуля. Модель
+    обучается при первом предсказании либо сразу при старте, если
+    preload_model=True.
+    """
+    app = FastAPI(title="Unified Battery System")
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    if settings.PROFILING_ENABLED:
+        app.add_middleware(ProfilingMiddleware)
+    app.include_router(router)
+
+    @app.on_event("startup")
+    def startup():
+        init_db()
+        prediction_log.start()
+        if preload_model:
+            db = SessionLocal()
+            try:
+                predictor.preload(db)
+            finally:
+                db.close()
+
+    @app.on_event("shutdown")
+    def shutdown():
+        prediction_log.stop()
+
+    return app
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -10,46 +10,101 @@ from models import BatteryData
 import json
 
 
+class StackedForest:
+    """Деревья леса, упакованные в плоские массивы NumPy.
+
+    Все деревья обходятся одновременно: на каждом уровне глубины один
+    векторный шаг для всех пар (образец, дерево), без цикла по estimators_.
+    """
+
+    def __init__(self, model):
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        sizes = np.array([tree.node_count for tree in trees])
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+        left = np.concatenate([tree.children_left for tree in trees])
+        right = np.concatenate([tree.children_right for tree in trees])
+        is_leaf = left == -1
+
+        # Индексы потомков переводим в глобальные; лист ссылается сам на себя,
+        # поэтому дошедшие до листа образцы стоят на месте
+        node_offsets = np.repeat(offsets, sizes)
+        own = np.arange(len(left))
+        left = np.where(is_leaf, own, left + node_offsets)
+        right = np.where(is_leaf, own, right + node_offsets)
+        # children[2 * node + go_right] - потомок без отдельного np.where
+        self.children = np.stack([left, right], axis=1).ravel().astype(np.intp)
+        self.feature = np.where(is_leaf, 0, np.concatenate([tree.feature for tree in trees])).astype(np.intp)
+        # Деревья sklearn сравнивают признаки во float32 с порогом float64
+        self.threshold = np.concatenate([tree.threshold for tree in trees])
+        self.value = np.concatenate([tree.value[:, 0, 0] for tree in trees])
+
+        self.roots = offsets.astype(np.intp)
+        self.max_depth = max(tree.max_depth for tree in trees)
+
+    def predict_trees(self, X):
+        """Предсказания каждого дерева: массив (n_samples, n_trees)"""
+        X = np.asarray(X, dtype=np.float32)
+        n_samples, n_features = X.shape
+        flat_X = X.ravel()
+        row_offsets = (np.arange(n_samples) * n_features)[:, None]
+
+        nodes = np.broadcast_to(self.roots, (n_samples, len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            go_right = flat_X[row_offsets + self.feature[nodes]] > self.threshold[nodes]
+            nodes = self.children[2 * nodes + go_right]
+        return self.value[nodes]
+
+
 class BatteryRULPredictor:
     def __init__(self):
         self.model = None
         self.scaler = StandardScaler()
+        self.forest = None
         self.is_trained = False
 
+    def battery_features(self, battery_data):
+        """Вектор признаков одной батареи (None, если циклов меньше трёх)"""
+        # Признаки на основе деградации емкости
+        capacity_data = battery_data['capacity'].values
+        cycles = len(capacity_data)
+
+        if cycles < 3:
+            return None
+
+        # Тренд деградации
+        x = np.arange(cycles)
+        slope = np.polyfit(x, capacity_data, 1)[0]
+
+        # Статистические признаки
+        mean_capacity = np.mean(capacity_data)
+        std_capacity = np.std(capacity_data)
+        capacity_fade = capacity_data[0] - capacity_data[-1]
+
+        # Признаки из последнего измерения
+        last_measurement = battery_data.iloc[-1]
+
+        return [
+            cycles,
+            slope,
+            mean_capacity,
+            std_capacity,
+            capacity_fade,
+            last_measurement['voltage'],
+            last_measurement['current'],
+            last_measurement['temperature'],
+            last_measurement['capacity']
+        ]
+
     def prepare_features(self, data):
         """Подготовка признаков для модели"""
         features = []
         for battery_id in data['battery_id'].unique():
             battery_data = data[data['battery_id'] == battery_id]
+            feature_vector = self.battery_features(battery_data)
 
-            # Признаки на основе деградации емкости
-            capacity_data = battery_data['capacity'].values
-            cycles = len(capacity_data)
-
-            if cycles >= 3:
-                # Тренд деградации
-                x = np.arange(cycles)
-                slope = np.polyfit(x, capacity_data, 1)[0]
-
-                # Статистические признаки
-                mean_capacity = np.mean(capacity_data)
-                std_capacity = np.std(capacity_data)
-                capacity_fade = capacity_data[0] - capacity_data[-1]
-
-                # Признаки из последнего измерения
-                last_measurement = battery_data.iloc[-1]
-
-                feature_vector = [
-                    cycles,
-                    slope,
-                    mean_capacity,
-                    std_capacity,
-                    capacity_fade,
-                    last_measurement['voltage'],
-                    last_measurement['current'],
-                    last_measurement['temperature'],
-                    last_measurement['capacity']
-                ]
+            if feature_vector is not None:
+                cycles = feature_vector[0]
 
                 # Целевая переменная - оставшиеся циклы (для обучения)
                 # В реальных данных это должно быть известно из исторических данных
@@ -99,6 +154,7 @@ class BatteryRULPredictor:
             # Обучение модели
             self.model = RandomForestRegressor(n_estimators=100, random_state=42)
             self.model.fit(X_scaled, y)
+            self.forest = StackedForest(self.model)
 
             self.is_trained = True
             print(f"Модель успешно обучена на {len(battery_data)} записях")
@@ -110,34 +166,64 @@ class BatteryRULPredictor:
 
     def predict(self, battery_data: list):
         """Предсказание RUL для новых данных"""
-        if not self.is_trained or self.model is None:
-            print("Модель не обучена")
+        interval = self.predict_interval(battery_data)
+        if interval is None:
             return None, 0.0
+        return interval['rul'], interval['confidence']
 
-        try:
-            # Преобразуем всю историю батареи в DataFrame
-            df = pd.DataFrame(battery_data)
-            df['battery_id'] = 'current'
+    def predict_interval(self, battery_data: list):
+        """Предсказание RUL с квантилями p10/p50/p90 по деревьям леса"""
+        return self.predict_batch({'current': battery_data}).get('current')
 
-            features_data = self.prepare_features(df)
+    def predict_batch(self, histories: dict):
+        """Предсказание RUL для нескольких батарей за один проход по лесу
 
-            if not features_data:
+        histories: {battery_id: [измерения, ...]}
+        Возвращает {battery_id: {...} или None, если признаки не построить}
+        """
+        if not self.is_trained or self.model is None:
+            print("Модель не обучена")
+            return {battery_id: None for battery_id in histories}
+
+        try:
+            ids = []
+            X = []
+            for battery_id, battery_data in histories.items():
+                feature_vector = self.battery_features(pd.DataFrame(battery_data))
+                if feature_vector is not None:
+                    ids.append(battery_id)
+                    X.append(feature_vector)
+
+            results = {battery_id: None for battery_id in histories}
+            if not X:
                 print("Не удалось подготовить признаки для предсказания")
-                return None, 0.0
+                return results
 
-            X = [features_data[0][0]]
             X_scaled = self.scaler.transform(X)
-
-            prediction = self.model.predict(X_scaled)[0]
-
-            # Confidence на основе близости к обучающим данным
-            confidence = min(0.95, max(0.1, 1.0 - abs(prediction - 500) / 1000))
-
-            return max(0, prediction), confidence
+            if self.forest is None:
+                self.forest = StackedForest(self.model)
+
+            # Предсказания всех деревьев: (n_batteries, n_trees)
+            tree_predictions = np.maximum(self.forest.predict_trees(X_scaled), 0)
+            rul = tree_predictions.mean(axis=1)
+            p10, p50, p90 = np.percentile(tree_predictions, [10, 50, 90], axis=1)
+
+            # Уверенность падает с ростом ширины интервала p10-p90 относительно медианы
+            confidence = np.clip(1.0 - (p90 - p10) / np.maximum(p50, 1.0), 0.0, 1.0)
+
+            for i, battery_id in enumerate(ids):
+                results[battery_id] = {
+                    'rul': float(rul[i]),
+                    'p10': float(p10[i]),
+                    'p50': float(p50[i]),
+                    'p90': float(p90[i]),
+                    'confidence': float(confidence[i]),
+                }
+            return results
 
         except Exception as e:
             print(f"Ошибка при предсказании: {e}")
-            return None, 0.0
+            return {battery_id: None for battery_id in histories}
 
     def save_model(self, filepath):
         """Сохранение модели"""
@@ -156,6 +242,7 @@ class BatteryRULPredictor:
             self.model = loaded['model']
             self.scaler = loaded['scaler']
             self.is_trained = loaded['is_trained']
+            self.forest = StackedForest(self.model) if self.model is not None else None
             print(f"Модель загружена из {filepath}")
         else:
             print(f"Файл {filepath} не найден")
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, DateTime, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, Float, DateTime, String, Boolean, ForeignKey, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -30,14 +30,47 @@ class BatteryData(Base):
     battery_id = Column(String(255), index=True)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
 
+    __table_args__ = (
+        Index("ix_battery_data_owner_battery_ts", "owner_id", "battery_id", "timestamp"),
+    )
+
 
 class PredictionResult(Base):
-    __tablename__ = "predictions"
+    """Журнал предсказаний (только добавление, пишется пачками)"""
+    __tablename__ = "prediction_log"
 
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    battery_id = Column(String(255), index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    battery_id = Column(String(255))
+    timestamp = Column(DateTime, default=datetime.utcnow)
+    predicted_rul = Column(Float)
+    rul_p10 = Column(Float)
+    rul_p50 = Column(Float)
+    rul_p90 = Column(Float)
+    confidence = Column(Float)
+    features = Column(LargeBinary(32))  # Последнее измерение, упакованное во float32
+
+    __table_args__ = (
+        Index("ix_prediction_log_owner_battery_ts", "owner_id", "battery_id", "timestamp"),
+        Index("ix_prediction_log_timestamp", "timestamp"),
+    )
+
+
+class LatestPrediction(Base):
+    """Последнее предсказание по каждой батарее пользователя"""
+    __tablename__ = "latest_predictions"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    battery_id = Column(String(255), nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     predicted_rul = Column(Float)
+    rul_p10 = Column(Float)
+    rul_p50 = Column(Float)
+    rul_p90 = Column(Float)
     confidence = Column(Float)
-    features = Column(String(1000))
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
\ No newline at end of file
+    current_cycle = Column(Integer)
+
+    __table_args__ = (
+        UniqueConstraint("owner_id", "battery_id", name="uq_latest_predictions_owner_battery"),
+    )
@@ -0,0 +1,225 @@
+"""Хранение результатов предсказаний.
+
+Текущее предсказание по каждой батарее лежит в latest_predictions и
+обновляется сразу (upsert по owner_id + battery_id), поэтому текущий RUL
+читается одним запросом по индексу. Полная история пишется в prediction_log
+пачками из буфера в памяти; последнее измерение хранится упакованным во
+float32, а не JSON-строкой. Старые записи журнала удаляются и прореживаются
+функцией compact (см. compact_predictions.py).
+"""
+import struct
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.orm import Session, aliased
+
+from config import settings
+from database import SessionLocal
+from models import LatestPrediction, PredictionResult
+
+FEATURE_FIELDS = ('voltage', 'current', 'temperature', 'capacity', 'cycle_number')
+_FEATURES = struct.Struct('<5f')
+
+_LATEST_FIELDS = ('timestamp', 'predicted_rul', 'rul_p10', 'rul_p50', 'rul_p90', 'confidence', 'current_cycle')
+_LOG_FIELDS = ('owner_id', 'battery_id', 'timestamp', 'predicted_rul', 'rul_p10', 'rul_p50', 'rul_p90',
+               'confidence', 'features')
+
+
+def pack_features(measurement: dict) -> bytes:
+    """Упаковка измерения в 20 байт (5 x float32)"""
+    return _FEATURES.pack(*(float(measurement[field] or 0.0) for field in FEATURE_FIELDS))
+
+
+def unpack_features(blob: bytes) -> dict:
+    values = _FEATURES.unpack(blob)
+    measurement = dict(zip(FEATURE_FIELDS, values))
+    measurement['cycle_number'] = int(measurement['cycle_number'])
+    return measurement
+
+
+def upsert_latest(db: Session, rows: list):
+    """Обновление latest_predictions одним запросом (без commit)"""
+    if not rows:
+        return
+
+    # Одна строка на батарею: побеждает последняя
+    latest = {(row['owner_id'], row['battery_id']): row for row in rows}
+    values = [
+        {'owner_id': owner_id, 'battery_id': battery_id, **{field: row[field] for field in _LATEST_FIELDS}}
+        for (owner_id, battery_id), row in latest.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        stmt = dialect_insert(LatestPrediction).values(values)
+        stmt = stmt.on_duplicate_key_update({field: stmt.inserted[field] for field in _LATEST_FIELDS})
+    else:
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(LatestPrediction).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['owner_id', 'battery_id'],
+            set_={field: stmt.excluded[field] for field in _LATEST_FIELDS},
+        )
+    db.execute(stmt)
+
+
+class PredictionLogBuffer:
+    """Буфер журнала предсказаний с пакетной записью.
+
+    Записи сбрасываются в БД фоновым потоком раз в flush_interval секунд или
+    сразу по достижении max_rows. При падении процесса теряется не более
+    одного интервала истории; latest_predictions от буфера не зависит.
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_rows: int = 500,
+                 flush_interval: float = 5.0, max_pending: int = 50000):
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def append(self, rows: list):
+        with self._lock:
+            self._rows.extend({field: row[field] for field in _LOG_FIELDS} for row in rows)
+            full = len(self._rows) >= self.max_rows
+
+        if full:
+            if self._thread is not None:
+                self._wake.set()
+            else:
+                self.flush()
+
+    def flush(self) -> int:
+        """Запись накопленных строк одним executemany; возвращает их число"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+
+            db = self.session_factory()
+            try:
+                db.execute(insert(PredictionResult), rows)
+                db.commit()
+                return len(rows)
+            except Exception as e:
+                db.rollback()
+                print(f"Ошибка записи журнала предсказаний: {e}")
+                with self._lock:
+                    # Возвращаем строки в буфер, но не даём ему расти бесконечно
+                    self._rows = (rows + self._rows)[-self.max_pending:]
+                return 0
+            finally:
+                db.close()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+prediction_log = PredictionLogBuffer(
+    max_rows=settings.PREDICTION_LOG_FLUSH_ROWS,
+    flush_interval=settings.PREDICTION_LOG_FLUSH_SECONDS,
+)
+
+
+def record_predictions(db: Session, rows: list):
+    """Сохранение предсказаний: upsert текущего значения и запись в журнал.
+
+    rows - словари с owner_id, battery_id, predicted_rul, rul_p10, rul_p50,
+    rul_p90, confidence, current_cycle и measurement (последнее измерение).
+    """
+    now = datetime.utcnow()
+    for row in rows:
+        row.setdefault('timestamp', now)
+        row['features'] = pack_features(row['measurement'])
+
+    upsert_latest(db, rows)
+    db.commit()
+    prediction_log.append(rows)
+
+
+def _delete_batches(db: Session, condition, batch_size: int) -> int:
+    """Удаление строк журнала по условию пачками по batch_size с commit после каждой"""
+    deleted = 0
+    while True:
+        # MySQL не даёт удалять из таблицы с подзапросом к ней же (ошибка 1093),
+        # поэтому сначала выбираем id пачки, затем удаляем их
+        ids = db.execute(select(PredictionResult.id).where(condition).limit(batch_size)).scalars().all()
+        if not ids:
+            return deleted
+        deleted += db.execute(delete(PredictionResult).where(PredictionResult.id.in_(ids))).rowcount
+        db.commit()
+
+
+def compact(db: Session, retention_days: int = settings.PREDICTION_RETENTION_DAYS,
+            downsample_after_days: int = settings.PREDICTION_DOWNSAMPLE_AFTER_DAYS,
+            batch_size: int = 1000):
+    """Удаление записей старше retention_days и прореживание журнала.
+
+    Для записей старше downsample_after_days остаётся только последняя
+    запись за сутки по каждой батарее. Удаление идёт пачками по batch_size
+    в отдельных транзакциях, поэтому первый запуск на большом журнале не
+    держит в памяти все id и не открывает одну огромную транзакцию.
+    Возвращает (удалено по сроку, удалено при прореживании).
+    """
+    now = datetime.utcnow()
+
+    expired = _delete_batches(
+        db, PredictionResult.timestamp < now - timedelta(days=retention_days), batch_size
+    )
+
+    cutoff = now - timedelta(days=downsample_after_days)
+    oldest = db.execute(
+        select(func.min(PredictionResult.timestamp)).where(PredictionResult.timestamp < cutoff)
+    ).scalar()
+
+    downsampled = 0
+    day = datetime.combine(oldest.date(), datetime.min.time()) if oldest is not None else cutoff
+    # По одним суткам: проверка "есть более поздняя запись батареи за те же
+    # сутки" идёт по индексу (owner_id, battery_id, timestamp) в пределах дня
+    while day < cutoff:
+        start, end = day, min(day + timedelta(days=1), cutoff)
+        later = aliased(PredictionResult)
+        redundant = and_(
+            PredictionResult.timestamp >= start,
+            PredictionResult.timestamp < end,
+            select(later.id).where(
+                later.owner_id == PredictionResult.owner_id,
+                later.battery_id == PredictionResult.battery_id,
+                later.timestamp >= start,
+                later.timestamp < end,
+                later.id > PredictionResult.id,
+            ).exists(),
+        )
+        downsampled += _delete_batches(db, redundant, batch_size)
+        day += timedelta(days=1)
+
+    return expired, downsampled
@@ -0,0 +1,64 @@
+"""Ленивая инициализация ML-модели.
+
+ml_model (а вместе с ним pandas, scikit-learn и joblib) импортируется только
+при первом обращении к предиктору, поэтому процессы, которые обслуживают лишь
+аутентификацию, не платят за загрузку ML-стека при старте.
+"""
+import threading
+
+from sqlalchemy.orm import Session
+
+_predictor = None
+_lock = threading.Lock()
+
+
+def _train_locked(db: Session):
+    global _predictor
+    if _predictor is None:
+        from ml_model import BatteryRULPredictor
+        _predictor = BatteryRULPredictor()
+    return _predictor.train(db)
+
+
+def get_predictor(db: Session):
+    """Возвращает предиктор, создавая и обучая его при первом использовании.
+
+    Обучение при первом обращении выполняется один раз. Если оно не удалось
+    (мало данных), повторная попытка делается только через refresh() или
+    retrain(), а не на каждом предсказании.
+    """
+    predictor = _predictor
+    if predictor is not None:
+        return predictor
+
+    with _lock:
+        if _predictor is None:
+            _train_locked(db)
+        return _predictor
+
+
+def retrain(db: Session) -> bool:
+    """Принудительное переобучение модели"""
+    with _lock:
+        return _train_locked(db)
+
+
+def refresh(db: Session) -> bool:
+    """Переобучение после поступления новых данных.
+
+    Если предиктор ещё не загружен, ничего не делаем: он обучится на
+    актуальных данных при первом предсказании. Если загружен (в том числе
+    после неудачного обучения), переобучаем.
+    """
+    if _predictor is None:
+        return False
+    return retrain(db)
+
+
+def preload(db: Session) -> bool:
+    """Загрузка и обучение модели заранее (например, при старте сервера)"""
+    return get_predictor(db).is_trained
+
+
+def is_trained() -> bool:
+    return _predictor is not None and _predictor.is_trained
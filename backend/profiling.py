@@ -0,0 +1,399 @@
+"""Выборочное профилирование запросов по требованию администратора.
+
+Профилирование включается без перезапуска сервера:
+
+- для эндпоинта или всех запросов - правилом с шаблоном пути (fnmatch),
+  ограниченным по времени и/или числу запросов;
+- для отдельных запросов - правилом с header_only: тогда профилируются
+  только запросы администратора с заголовком `X-Profile: 1`.
+
+Пока запрос профилируется, отдельный поток раз в interval_ms снимает стеки
+потоков пула, выполняющих эндпоинт и его зависимости (sys._current_frames),
+и копит свёрнутые стеки (collapsed stacks). Потоки пула отмечаются подменой
+anyio.to_thread.run_sync, которая действует только пока идёт хотя бы один
+снимок. Сериализация ответа в потоке event loop в снимок не попадает. Каждый
+снимок сохраняется JSON-файлом (и маленьким файлом метаданных для списка) в
+каталог с ограниченным числом снимков и отдаётся в формате collapsed или
+speedscope. Без правил middleware только проверяет, что словарь правил пуст:
+заголовки не разбираются, эндпоинты и зависимости ничем не обёрнуты.
+
+Правила хранятся в памяти процесса: при нескольких воркерах uvicorn правило
+действует только в воркере, который принял запрос администратора.
+"""
+import contextvars
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from fnmatch import fnmatchcase
+
+import anyio.to_thread
+from starlette.concurrency import run_in_threadpool
+
+from auth import decode_token
+from config import settings
+
+PROFILE_HEADER = b"x-profile"
+
+_current_capture = contextvars.ContextVar("profiling_capture", default=None)
+
+
+class Capture:
+    """Стеки одного профилируемого запроса"""
+
+    def __init__(self, method: str, path: str, interval: float, rule_id: str | None):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.interval = interval
+        self.rule_id = rule_id
+        self.started_at = datetime.utcnow()
+        self.status = None
+        self.duration = 0.0
+        self._started = 0.0
+        self.samples = 0
+        self.stacks = {}
+        self.threads = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.id}", daemon=True)
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        """Останавливает сэмплирование, не дожидаясь потока (вызывается в event loop)"""
+        self.duration = time.perf_counter() - self._started
+        self._stopped.set()
+
+    def join(self):
+        self._sampler.join()
+
+    def track_current_thread(self):
+        with self._lock:
+            self.threads.add(threading.get_ident())
+
+    def untrack_current_thread(self):
+        with self._lock:
+            self.threads.discard(threading.get_ident())
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                threads = tuple(self.threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = _collapse(frame)
+                    self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                    self.samples += 1
+
+    def metadata(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "rule_id": self.rule_id,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 2),
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+        }
+
+    def to_dict(self) -> dict:
+        return {**self.metadata(), "stacks": self.stacks}
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    # Путь внутри site-packages короче и одинаков на всех машинах
+    for marker in ("site-packages" + os.sep, "dist-packages" + os.sep):
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+            break
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    # ';' разделяет кадры в формате collapsed
+    return ";".join(reversed(names)).replace("\n", " ")
+
+
+def to_collapsed(capture: dict) -> str:
+    """Формат collapsed stacks (flamegraph.pl, speedscope, inferno)"""
+    return "".join(f"{stack} {count}\n" for stack, count in capture["stacks"].items())
+
+
+def to_speedscope(capture: dict) -> dict:
+    """Формат speedscope (https://www.speedscope.app/file-format-schema.json)"""
+    frame_index = {}
+    samples = []
+    weights = []
+    for stack, count in capture["stacks"].items():
+        samples.append([frame_index.setdefault(name, len(frame_index)) for name in stack.split(";")])
+        weights.append(count * capture["interval_ms"])
+
+    total = sum(weights)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": [{"name": name} for name in frame_index]},
+        "profiles": [{
+            "type": "sampled",
+            "name": f"{capture['method']} {capture['path']}",
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": total,
+            "samples": samples,
+            "weights": weights,
+        }],
+        "name": f"{capture['method']} {capture['path']} ({capture['id']})",
+        "exporter": "battery-system profiling",
+    }
+
+
+class RequestProfiler:
+    """Правила профилирования и кольцевое хранилище снимков на диске"""
+
+    def __init__(self, directory: str, max_captures: int = 50, default_interval_ms: float = 5.0):
+        self.directory = directory
+        self.max_captures = max_captures
+        self.default_interval = default_interval_ms / 1000
+        self.rules = {}
+        self._lock = threading.Lock()
+        self._rule_ids = itertools.count(1)
+
+    # -------- правила --------
+    def add_rule(self, pattern: str = "*", duration_seconds: float | None = None,
+                 max_requests: int | None = None, interval_ms: float | None = None,
+                 header_only: bool = False) -> dict:
+        rule = {
+            "id": str(next(self._rule_ids)),
+            "pattern": pattern,
+            "header_only": header_only,
+            "until": datetime.utcnow() + timedelta(seconds=duration_seconds) if duration_seconds else None,
+            "remaining": max_requests,
+            "interval_ms": interval_ms or self.default_interval * 1000,
+        }
+        with self._lock:
+            self.rules[rule["id"]] = rule
+        return rule
+
+    def remove_rule(self, rule_id: str) -> bool:
+        with self._lock:
+            return self.rules.pop(rule_id, None) is not None
+
+    def clear_rules(self):
+        with self._lock:
+            self.rules.clear()
+
+    def list_rules(self) -> list:
+        with self._lock:
+            self._expire_rules()
+            return [dict(rule) for rule in self.rules.values()]
+
+    def _expire_rules(self):
+        now = datetime.utcnow()
+        for rule_id, rule in list(self.rules.items()):
+            if (rule["until"] is not None and rule["until"] <= now) or rule["remaining"] == 0:
+                del self.rules[rule_id]
+
+    def select(self, scope) -> Capture | None:
+        """Нужно ли профилировать запрос (вызывается, только если есть правила)"""
+        path = scope["path"]
+        requested = None
+        with self._lock:
+            self._expire_rules()
+            for rule in self.rules.values():
+                if not fnmatchcase(path, rule["pattern"]):
+                    continue
+                if rule["header_only"]:
+                    if requested is None:
+                        requested = _profile_requested(scope)
+                    if not requested:
+                        continue
+                if rule["remaining"] is not None:
+                    rule["remaining"] -= 1
+                return Capture(scope["method"], path, rule["interval_ms"] / 1000, rule["id"])
+        return None
+
+    # -------- хранилище --------
+    def save(self, capture: Capture):
+        """Дожидается потока сэмплирования и пишет снимок и его метаданные"""
+        capture.join()
+        os.makedirs(self.directory, exist_ok=True)
+        stem = f"{capture.started_at:%Y%m%dT%H%M%S%f}_{capture.id}"
+        # Метаданные пишутся последними: снимок из списка всегда можно скачать
+        self._write(f"{stem}.json", capture.to_dict())
+        self._write(f"{stem}.meta", capture.metadata())
+        self._trim()
+
+    def _write(self, filename: str, data: dict):
+        tmp_path = os.path.join(self.directory, filename + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, os.path.join(self.directory, filename))
+
+    def _files(self, extension: str = ".json") -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(extension))
+
+    def _trim(self):
+        files = self._files()
+        for name in files[:max(0, len(files) - self.max_captures)]:
+            stem = name[:-len(".json")]
+            for filename in (f"{stem}.meta", name):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+
+    def _read(self, name: str) -> dict | None:
+        try:
+            with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # Файл мог быть вытеснен из кольца между listdir и open
+            return None
+
+    def list_captures(self) -> list:
+        """Метаданные снимков, новые первыми; стеки не читаются"""
+        captures = []
+        for name in reversed(self._files(".meta")):
+            capture = self._read(name)
+            if capture is not None:
+                captures.append(capture)
+        return captures
+
+    def load(self, capture_id: str) -> dict | None:
+        for name in self._files():
+            if name.endswith(f"_{capture_id}.json"):
+                return self._read(name)
+        return None
+
+
+def _profile_requested(scope) -> bool:
+    """Заголовок X-Profile в запросе администратора"""
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            return value not in (b"0", b"") and _is_admin(scope)
+    return False
+
+
+def _is_admin(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return False
+            payload = decode_token(token)
+            return payload is not None and payload.get("role") == "ADMIN"
+    return False
+
+
+profiler = RequestProfiler(
+    settings.PROFILE_DIR,
+    max_captures=settings.PROFILE_MAX_CAPTURES,
+    default_interval_ms=settings.PROFILE_INTERVAL_MS,
+)
+
+
+class _ThreadpoolHook:
+    """Подмена anyio.to_thread.run_sync на время активных снимков.
+
+    Синхронные эндпоинты и зависимости (в том числе вход и выход get_db)
+    FastAPI выполняет через anyio.to_thread.run_sync. Пока идёт хотя бы один
+    снимок, подменённая функция отмечает поток пула в снимке текущего запроса;
+    когда снимков нет, исходная функция возвращается на место. Dependant.call
+    не меняется, поэтому app.dependency_overrides работают как обычно.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.original = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.active == 0:
+                self.original = anyio.to_thread.run_sync
+                anyio.to_thread.run_sync = self._run_sync
+            self.active += 1
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+            if self.active == 0:
+                anyio.to_thread.run_sync = self.original
+
+    async def _run_sync(self, func, *args, **kwargs):
+        capture = _current_capture.get()
+        if capture is not None:
+            func = functools.partial(_tracked, capture, func)
+        return await self.original(func, *args, **kwargs)
+
+
+def _tracked(capture: Capture, func, *args):
+    capture.track_current_thread()
+    try:
+        return func(*args)
+    finally:
+        capture.untrack_current_thread()
+
+
+_threadpool_hook = _ThreadpoolHook()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: запускает и сохраняет снимок для выбранных запросов"""
+
+    def __init__(self, app, profiler: RequestProfiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        # Без правил - единственная проверка на запрос
+        if not self.profiler.rules or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        capture = self.profiler.select(scope)
+        if capture is None:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                capture.status = message["status"]
+                message.setdefault("headers", []).append((b"x-profile-id", capture.id.encode()))
+            await send(message)
+
+        token = _current_capture.set(capture)
+        _threadpool_hook.acquire()
+        capture.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            capture.stop()
+            _threadpool_hook.release()
+            _current_capture.reset(token)
+            # Ожидание потока сэмплирования и запись на диск - не в event loop
+            try:
+                await run_in_threadpool(self.profiler.save, capture)
+            except OSError as e:
+                print(f"Не удалось сохранить профиль {capture.id}: {e}")
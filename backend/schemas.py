@@ -1,4 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from typing import List
+
+from pydantic import BaseModel, EmailStr, Field
 
 
 class UserRegister(BaseModel):
@@ -33,4 +35,15 @@ class BatteryIn(BaseModel):
     temperature: float
     capacity: float
     cycle_number: int
-    battery_id: str = "default"
\ No newline at end of file
+    battery_id: str = "default"
+
+class BatchPredictIn(BaseModel):
+    battery_ids: List[str] = Field(..., min_length=1, max_length=1000)
+
+
+class ProfilingRuleIn(BaseModel):
+    pattern: str = "*"  # шаблон пути, например /api/predict-rul/*
+    duration_seconds: float | None = Field(None, gt=0)
+    max_requests: int | None = Field(None, gt=0)
+    interval_ms: float | None = Field(None, ge=1, le=1000)
+    header_only: bool = False  # только запросы администратора с X-Profile: 1